@@ -1,99 +1,142 @@
+import re
 import serial
 import matplotlib.pyplot as plt
 import math
 import scipy.optimize
 import numpy as np
-from more_itertools import *
+
+REPORT_PATTERN = re.compile(rb'T:(-?\d+).*?LM:(-?\d+)')
+
+
+def grow(*arrays):
+    return tuple(np.resize(a, 2 * a.size) for a in arrays)
 
 
 def frequency_motor(s, run_time, frequency, gain):
+    power_lut = (gain / 2 + gain / 2 * np.sin(2 * np.pi * frequency * np.arange(run_time + 1))).astype(np.int32)
+
     s.write(b'time report on\n')
     s.write(b'motor left report on\n')
 
     start_time = None
     p = None
+    last_power_time = None
+
+    capacity = 1024
+    times = np.empty(capacity, dtype=np.int64)
+    positions = np.empty(capacity, dtype=np.int64)
+    powers = np.empty(capacity, dtype=np.float64)
+    count = 0
 
-    times = []
-    positions = []
-    powers = []
-
-    while True:
-        line = s.readline()
-        if b',' in line and b':' in line:
-            time = None
-            position = None
-
-            words = line.split(b',')
-            for word in words:
-                parts = word.split(b':')
-                if parts[0] == b'T':
-                    try:
-                        time = int(parts[1])
-                    except ValueError:
-                        print('Error parsing {} from {}'.format(parts[1], line))
-                elif parts[0] == b'LM':
-                    try:
-                        position = int(parts[1])
-                    except ValueError:
-                        print('Error parsing {} from {}'.format(parts[1], line))
+    buf = bytearray()
+    done = False
+
+    while not done:
+        buf += s.read(s.in_waiting or 1)
+        if b'\n' not in buf:
+            continue
+
+        complete, buf = buf.rsplit(b'\n', 1)
+
+        # Fast-reject batches with no report lines before paying for the regex
+        if b'T:' not in complete:
+            continue
+
+        for match in REPORT_PATTERN.finditer(complete):
+            time = int(match.group(1))
+            position = int(match.group(2))
 
             if start_time is None:
                 start_time = time
-            else:
-                time = time - start_time
-                if time is not None and position is not None:
-                    times.append(time)
-                    positions.append(position)
-                    powers.append(p)
+                continue
 
-                    if time % 10 == 0:
-                        p = gain / 2 + gain / 2 * math.sin(2 * math.pi * time * frequency)
-                        s.write(b'motor left set %d\n' % p)
+            time -= start_time
 
-                    if time >= run_time:
-                        s.write(b'motor left set 0\n')
-                        s.write(b'motor left report off\n')
-                        s.write(b'time report off\n')
-                        break
+            if count == capacity:
+                capacity *= 2
+                times, positions, powers = grow(times, positions, powers)
 
-    return times, positions, powers
+            times[count] = time
+            positions[count] = position
+            powers[count] = np.nan if p is None else p
+            count += 1
 
+        if count == 0:
+            continue
 
-s = serial.Serial('/dev/ttyUSB0', 230400, timeout=1)
+        time = int(times[count - 1])
 
+        if last_power_time is None or time - last_power_time >= 10:
+            power = int(power_lut[min(time, run_time)])
+            if power != p:
+                s.write(b'motor left set %d\n' % power)
+                p = power
+            last_power_time = time
 
-def calc_velocity(d):
-    (last_time, last_position), (next_time, next_position) = d
-    return (next_position - last_position) - (next_time - last_time)
+        if time >= run_time:
+            s.write(b'motor left set 0\n')
+            s.write(b'motor left report off\n')
+            s.write(b'time report off\n')
+            done = True
 
+    return times[:count], positions[:count], powers[:count]
 
-times, positions, powers = frequency_motor(s, 5000, 0.002, 10000)
 
-times, positions, powers = unzip(filter(lambda d: d[0] >= 1000, zip(times, positions, powers)))
+s = serial.Serial('/dev/ttyUSB0', 230400, timeout=1)
 
-times = list(times)
-positions = list(positions)
-powers = list(powers)
+times, positions, powers = frequency_motor(s, 5000, 0.002, 10000)
 
-velocities = list(map(calc_velocity, windowed(zip(times, positions), 2)))
+mask = times >= 1000
+times = times[mask]
+positions = positions[mask]
+powers = powers[mask]
 
-velocities.append(last(velocities))
+velocities = (positions[1:] - positions[:-1]) - (times[1:] - times[:-1])
+velocities = np.append(velocities, velocities[-1])
 
 
 def sine(t, offset, gain, frequency, phase):
     return offset + gain * np.sin(2*math.pi*t*frequency + phase)
 
 
-popt, pcov = scipy.optimize.curve_fit(sine, times, velocities, p0=[3, 2.5, 0.002, 0])
+def sine_jac(t, offset, gain, frequency, phase):
+    a = 2 * math.pi * t * frequency + phase
+    c = np.cos(a)
+    return np.stack([np.ones_like(t), np.sin(a), gain * c * 2 * math.pi * t, gain * c], axis=1)
+
+
+class MemoFun:
+    """
+    Cache the last evaluation of a model function, since curve_fit evaluates
+    the model with identical parameters several times while setting up
+    """
+
+    def __init__(self, f):
+        self.f = f
+        self.last_params = None
+        self.last_result = None
+
+    def __call__(self, t, *params):
+        if self.last_params is None or not np.array_equal(params, self.last_params):
+            self.last_params = params
+            self.last_result = self.f(t, *params)
+        return self.last_result
+
+
+times = np.asarray(times, dtype=np.float64)
+velocities = np.asarray(velocities, dtype=np.float64)
+
+popt, pcov = scipy.optimize.curve_fit(MemoFun(sine), times, velocities, p0=[3, 2.5, 0.002, 0],
+                                      jac=sine_jac, check_finite=False, xtol=1e-6, ftol=1e-6)
 
 print(popt)
 print(pcov)
 
-fit_velocities = list(map(lambda t: sine(t, *popt), times))
+fit_velocities = sine(times, *popt)
 
 plt.plot(
     #times, velocities,
-    times, list(map(lambda p: p / 1000 if p is not None else None, powers)),
+    times, powers / 1000,
     times, fit_velocities,
     linewidth=1
 )
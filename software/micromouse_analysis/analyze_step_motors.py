@@ -1,8 +1,14 @@
+import re
 import serial
-from more_itertools import *
+import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib import collections
-import control
+
+REPORT_PATTERN = re.compile(rb'T:(-?\d+).*?LM:(-?\d+)')
+
+
+def grow(*arrays):
+    return tuple(np.resize(a, 2 * a.size) for a in arrays)
 
 
 def step_motor(s, before_time, step_time, after_time, gain):
@@ -13,102 +19,116 @@ def step_motor(s, before_time, step_time, after_time, gain):
 
     step = 0
 
-    motor_positions = []
-
-    while True:
-        line = s.readline()
-        if b',' in line and b':' in line:
-            time = None
-            position = None
-
-            words = line.split(b',')
-            for word in words:
-                parts = word.split(b':')
-                if parts[0] == b'T':
-                    try:
-                        time = int(parts[1])
-                    except ValueError:
-                        print('Error parsing {} from {}'.format(parts[1], line))
-                elif parts[0] == b'LM':
-                    try:
-                        position = int(parts[1])
-                    except ValueError:
-                        print('Error parsing {} from {}'.format(parts[1], line))
-
-            if start_time is None or time is None:
+    capacity = 1024
+    times = np.empty(capacity, dtype=np.int64)
+    positions = np.empty(capacity, dtype=np.int64)
+    steps = np.empty(capacity, dtype=np.int8)
+    count = 0
+
+    buf = bytearray()
+    done = False
+
+    while not done:
+        buf += s.read(s.in_waiting or 1)
+        if b'\n' not in buf:
+            continue
+
+        complete, buf = buf.rsplit(b'\n', 1)
+
+        # Fast-reject batches with no report lines before paying for the regex
+        if b'T:' not in complete:
+            continue
+
+        for match in REPORT_PATTERN.finditer(complete):
+            time = int(match.group(1))
+            position = int(match.group(2))
+
+            if start_time is None:
                 start_time = time
-            else:
-                if time is not None and position is not None:
-                    motor_positions.append({
-                        'time': time,
-                        'position': position,
-                        'step': step,
-                    })
-
-                if step == 0 and time - start_time > before_time:
-                    s.write(b'motor left set %d\n' % gain)
-                    start_time = time
-                    step = 1
-                elif step == 1 and time - start_time > step_time:
-                    s.write(b'motor left set 0\n')
-                    start_time = time
-                    step = 2
-                elif step == 2 and time - start_time > after_time:
-                    s.write(b'motor left report off\n')
-                    s.write(b'time report off\n')
-                    break
-
-    return motor_positions
-
-
-def calc_velocity(positions):
-    current_position, next_position = positions
-    delta_time = next_position['time'] - current_position['time']
-    delta_position = next_position['position'] - current_position['position']
-    return {
-        'time': current_position['time'],
-        'step': current_position['step'],
-        'velocity': delta_position / delta_time,
-    }
-
-
-def to_velocity(motor_positions):
-    return list(map(calc_velocity, windowed(motor_positions, 2)))
-
-
-def calc_final_velocity(velocities, time):
+                continue
+
+            if count == capacity:
+                capacity *= 2
+                times, positions, steps = grow(times, positions, steps)
+
+            times[count] = time
+            positions[count] = position
+            steps[count] = step
+            count += 1
+
+        if count == 0:
+            continue
+
+        time = int(times[count - 1])
+
+        if step == 0 and time - start_time > before_time:
+            s.write(b'motor left set %d\n' % gain)
+            start_time = time
+            step = 1
+        elif step == 1 and time - start_time > step_time:
+            s.write(b'motor left set 0\n')
+            start_time = time
+            step = 2
+        elif step == 2 and time - start_time > after_time:
+            s.write(b'motor left report off\n')
+            s.write(b'time report off\n')
+            done = True
+
+    return times[:count], positions[:count], steps[:count]
+
+
+def compute_velocity(times, positions):
+    return np.diff(positions) / np.diff(times)
+
+
+try:
+    # When numba is available, JIT the derivative loop for offline replays of
+    # captured runs; cache=True keeps the compile cost to the first run only
+    from numba import njit
+
+    @njit(cache=True, fastmath=True)
+    def compute_velocity(times, positions):
+        velocities = np.empty(times.size - 1)
+        for i in range(times.size - 1):
+            velocities[i] = (positions[i + 1] - positions[i]) / (times[i + 1] - times[i])
+        return velocities
+except ImportError:
+    pass
+
+
+def to_velocity(times, positions, steps):
+    return times[:-1], steps[:-1], compute_velocity(times, positions)
+
+
+def calc_final_velocity(times, velocities, time):
     """
     Calculate the final veclocity as an average over `time` of the last velocities in the run step
-    :param velocities: A list of dictionaries with `time`, `step`, and `velocity` keys
+    :param times: An array of sample times
+    :param velocities: An array of velocities parallel to `times`
     :param time: How much time of samples to average over
     :return: The average velocity as the end of the run step
     """
-    last_time = last(velocities)['time']
-    final_velocities = list(filter(lambda d: last_time - d['time'] <= time, velocities));
-    final_average = sum(map(lambda d: d['velocity'], final_velocities)) / len(final_velocities)
-    return final_average
+    return velocities[times >= times[-1] - time].mean()
 
 
-def time_at_velocity(velocities, velocity):
+def time_at_velocity(times, velocities, velocity):
     """
     Calculate the time when the velocity in `velocities` first crosses `velocity` with a rising edge
-    :param velocities: A list of dictionaries with `time` and `velocity` keys
+    :param times: An array of sample times
+    :param velocities: An array of velocities parallel to `times`
     :param velocity: The velocity to calculate the time of when velocities crosses it
     :return: The time of crossing
     """
 
-    return next(map(lambda d: d[0]['time'], filter(lambda d: d[0]['velocity'] <= velocity < d[1]['velocity'],
-                                                   windowed(velocities, 2))))
-
-
-def extract(data, key):
-    return list(map(lambda d: d[key], data))
+    crossing = np.argmax((velocities[:-1] <= velocity) & (velocities[1:] > velocity))
+    return times[crossing]
 
 
 def plot_steps(ax, times, steps, ymin, ymax):
-    steps0 = list(map(lambda s: s == 0, steps))
-    steps1 = list(map(lambda s: s == 1, steps))
-    steps2 = list(map(lambda s: s == 2, steps))
+    steps = np.asarray(steps)
+    steps0 = steps == 0
+    steps1 = steps == 1
+    steps2 = steps == 2
 
     steps0_collection = collections.BrokenBarHCollection.span_where(times, ymin=ymin, ymax=ymax,
                                                                     where=steps0,
@@ -130,49 +150,36 @@ def plot_steps(ax, times, steps, ymin, ymax):
     ax.add_collection(steps2_collection)
 
 
-def filter_velocities(v):
-    time_start = time_at_velocity(v, 0)
-    v_offset = list(map(lambda d: {'time': d['time'] - time_start, 'velocity': d['velocity']},
-                        filter(lambda d: d['step'] == 1 and d['time'] >= time_start, v)))
+def filter_velocities(times, steps, velocities):
+    time_start = time_at_velocity(times, velocities, 0)
+    mask = (steps == 1) & (times >= time_start)
 
-    return v_offset
+    return times[mask] - time_start, velocities[mask]
 
 
-def calc_tf_constants(v, average_time, gain):
-    final_v = calc_final_velocity(v, average_time)
+def calc_tf_constants(times, velocities, average_time, gain):
+    final_v = calc_final_velocity(times, velocities, average_time)
     ta_v = 0.632 * final_v
-    ta = time_at_velocity(v, ta_v)
+    ta = time_at_velocity(times, velocities, ta_v)
     return ta, final_v / gain
 
 
-def calc_tf(ta, final_v):
-    s = control.tf('s')
-    tf = final_v / (ta * s + 1)
-    return tf
-
-
 def step_motor_and_calc_constants(s, start_time, run_time, end_time, average_time, gain):
-    p = step_motor(s, start_time, run_time, end_time, gain)
-    v = to_velocity(p)
-    v_run = filter_velocities(v)
+    times, positions, steps = step_motor(s, start_time, run_time, end_time, gain)
+    v_times, v_steps, velocities = to_velocity(times, positions, steps)
+    run_times, run_velocities = filter_velocities(v_times, v_steps, velocities)
 
-    times = extract(v_run, 'time')
-    velocities = extract(v_run, 'velocity')
+    ta, final_v = calc_tf_constants(run_times, run_velocities, average_time, gain)
 
-    ta, final_v = calc_tf_constants(v_run, average_time, gain)
+    return ta, final_v, run_times, run_velocities
 
-    return ta, final_v, times, velocities
 
-
-def plot_tf(ax, ta, final_v, gain, times=None, **kwargs):
-    tf = calc_tf(ta, final_v)
-
-    if times is not None:
-        start_time = min(times)
-        end_time = max(times)
-        times = range(start_time, end_time)
-
-    step_times, step_response = control.step_response(gain * tf, times)
+def plot_tf(ax, ta, final_v, gain, times, **kwargs):
+    # The step response of gain * final_v / (ta*s + 1) has the closed form
+    # gain * final_v * (1 - exp(-t/ta)), so there is no need for an ODE solve.
+    # Sample times are monotonically increasing, so the endpoints are the extremes
+    step_times = np.arange(int(times[0]), int(times[-1]))
+    step_response = gain * final_v * (1 - np.exp(-step_times / ta))
 
     ax.plot(step_times, step_response, linewidth=1.0, **kwargs)
 
@@ -191,15 +198,15 @@ def do_analyze(port, baud, start_time, run_time, end_time, average_time, gain, i
 
     results = list(map(step, range(0, iterations)))
 
+    average_ta = sum(map(lambda r: r[0], results)) / len(results)
+    average_final_v = sum(map(lambda r: r[1], results)) / len(results)
+
     fig, ax = plt.subplots()
 
     for ta, final_v, times, velocities in results:
         plot_tf(ax, ta, final_v, gain, times=times, alpha=0.5, color="grey")
         plot_data(ax, times, velocities, color="red", alpha=0.2)
 
-    average_ta = sum(map(lambda r: r[0], results)) / len(results)
-    average_final_v = sum(map(lambda r: r[1], results)) / len(results)
-
     print("Time constant: {}".format(average_ta))
     print("Final value: {}".format(average_final_v))
 
@@ -1,115 +1,103 @@
 import matplotlib.pyplot as plt
-from bezier._py_curve_helpers import get_curvature, evaluate_hodograph
 from bezier.curve import Curve
-from more_itertools import *
 import pint
 import numpy as np
 import math as m
 
 u = pint.UnitRegistry()
-u.setup_matplotlib()
 
 
-def curvature_at_t(curve, t):
-    curve, units = curve
-    tangent_vec = evaluate_hodograph(t, curve.nodes)
-    curvature = get_curvature(curve.nodes, tangent_vec, t)
-    return curvature * u.radians / units
+def hodograph_nodes(nodes):
+    degree = nodes.shape[1] - 1
+    return degree * (nodes[:, 1:] - nodes[:, :-1])
 
 
-def length_at_t(curve, t):
+def curvatures_at(curve, ss):
     curve, units = curve
-    curve_to_t = curve.specialize(0, t)
-    return curve_to_t.length * units
-
+    first = hodograph_nodes(curve.nodes)
+    second = hodograph_nodes(first)
 
-def calc_accelerations(d):
-    (last_time, next_time), (last_velocity, next_velocity) = d
+    dx, dy = Curve(first, degree=curve.degree - 1).evaluate_multi(ss)
+    ddx, ddy = Curve(second, degree=curve.degree - 2).evaluate_multi(ss)
 
-    delta_time = next_time - last_time
-    delta_velocity = next_velocity - last_velocity
-    acceleration = delta_velocity / delta_time
+    curvatures = (dx * ddy - dy * ddx) / (dx * dx + dy * dy) ** 1.5
+    return curvatures * u.radians / units
 
-    center_time = (next_time + last_time) / 2
 
-    return center_time, acceleration
+def lengths_at(curve, ss):
+    curve, units = curve
+    points = curve.evaluate_multi(ss)
+    segments = np.linalg.norm(np.diff(points, axis=1), axis=0)
+    return np.concatenate([[0], np.cumsum(segments)]) * units
 
 
-def map_units(f, i):
-    results_with_units = list(map(f, i))
-    results_without_units = list(map(lambda x: x.magnitude, results_with_units))
-    return np.array(results_without_units) * results_with_units[0].units
+def calc_accelerations(times, velocities):
+    delta_times = times[1:] - times[:-1]
+    delta_velocities = velocities[1:] - velocities[:-1]
 
+    center_times = (times[1:] + times[:-1]) / 2
 
-def extract_units(i):
-    results_with_units = list(i)
-    results_without_units = list(map(lambda x: x.magnitude, results_with_units))
-    return np.array(results_without_units) * results_with_units[0].units
+    return center_times, delta_velocities / delta_times
 
 
 def acceleration_curve(fig, wheelbase: float, wheel_radius: float, mass: float, curve, linear_velocity: float):
     ss = np.linspace(0, 1, 1000)
 
-    ls = map_units(lambda t: length_at_t(curve, t), ss)
-
-    ts = ls / linear_velocity
-
-    curvatures = map_units(lambda t: curvature_at_t(curve, t), ss)
+    # Work on raw base-unit magnitudes so none of the array math below pays
+    # for per-operation unit bookkeeping, then re-wrap for plotting
+    wheelbase = wheelbase.to_base_units().magnitude
+    wheel_radius = wheel_radius.to_base_units().magnitude
+    mass = mass.to_base_units().magnitude
+    linear_velocity = linear_velocity.to_base_units().magnitude
 
-    angular_velocities = map_units(lambda curvature: curvature * linear_velocity, curvatures)
+    ls = lengths_at(curve, ss).to_base_units().magnitude
+    curvatures = curvatures_at(curve, ss).to_base_units().magnitude
 
-    left_velocities = map_units(lambda angular_velocity: linear_velocity - angular_velocity * wheelbase / 2, angular_velocities)
-    right_velocities = map_units(lambda angular_velocity: linear_velocity + angular_velocity * wheelbase / 2, angular_velocities)
-
-    left_acc_ts, left_accelerations = unzip(map(calc_accelerations, zip(windowed(ts, 2), windowed(left_velocities, 2))))
+    ts = ls / linear_velocity
 
-    left_acc_ts = extract_units(left_acc_ts)
-    left_accelerations = extract_units(left_accelerations)
+    angular_velocities = curvatures * linear_velocity
 
-    right_acc_ts, right_accelerations = unzip(
-        map(calc_accelerations, zip(windowed(ts, 2), windowed(right_velocities, 2))))
+    left_velocities = linear_velocity - angular_velocities * wheelbase / 2
+    right_velocities = linear_velocity + angular_velocities * wheelbase / 2
 
-    right_acc_ts = extract_units(right_acc_ts)
-    right_accelerations = extract_units(right_accelerations)
+    left_acc_ts, left_accelerations = calc_accelerations(ts, left_velocities)
+    right_acc_ts, right_accelerations = calc_accelerations(ts, right_velocities)
 
-    left_angular_acceleration = left_accelerations / (wheel_radius / u.radian)
-    right_angular_acceleration = right_accelerations / (wheel_radius / u.radian)
+    left_angular_acceleration = left_accelerations / wheel_radius
+    right_angular_acceleration = right_accelerations / wheel_radius
 
     rotational_inertia = mass * wheel_radius**2 / 2
 
+    # Everything is already in base units, so the torque magnitudes are in N m
     left_torque = rotational_inertia * left_angular_acceleration
     right_torque = rotational_inertia * right_angular_acceleration
 
     (ax1, ax2), (ax3, ax4) = fig.subplots(2, 2)
 
-    ts.ito_base_units()
-    curvatures.ito_base_units()
-    angular_velocities.ito_base_units()
-    left_velocities.ito_base_units()
-    right_velocities.ito_base_units()
-    left_accelerations.ito_base_units()
-    right_accelerations.ito_base_units()
-    left_acc_ts.ito_base_units()
-    right_acc_ts.ito_base_units()
-    left_angular_acceleration.ito_base_units()
-    right_angular_acceleration.ito_base_units()
-    left_torque.ito(u.newton * u.meter)
-    right_torque.ito(u.newton * u.meter)
-
-    print(max(left_torque))
+    print('max left torque: {} N m'.format(left_torque.max()))
 
     ax1.plot(left_acc_ts, left_torque)
     ax1.plot(right_acc_ts, right_torque)
+    ax1.set_xlabel('t [s]')
+    ax1.set_ylabel('torque [N m]')
     ax2.plot(ts, curvatures)
+    ax2.set_xlabel('t [s]')
+    ax2.set_ylabel('curvature [rad/m]')
     ax2l = ax2.twinx()
     ax2l.plot(ts, angular_velocities)
+    ax2l.set_ylabel('angular velocity [rad/s]')
     ax4.plot(ts, left_velocities)
     ax4.plot(ts, right_velocities)
+    ax4.set_xlabel('t [s]')
+    ax4.set_ylabel('wheel velocity [m/s]')
     ax3.plot(left_acc_ts, left_accelerations)
     ax3.plot(right_acc_ts, right_accelerations)
+    ax3.set_xlabel('t [s]')
+    ax3.set_ylabel('acceleration [m/s^2]')
     ax3l = ax3.twinx()
     ax3l.plot(left_acc_ts, left_angular_acceleration)
     ax3l.plot(right_acc_ts, right_angular_acceleration)
+    ax3l.set_ylabel('angular acceleration [rad/s^2]')
 
 
 def corner_curve(r, offset):